@@ -7,18 +7,194 @@ Send Claude Code event notifications to Slack via Webhook or Direct Message
 import os
 import sys
 import json
-import argparse
-from datetime import datetime
-from urllib.request import Request, urlopen
-from urllib.error import URLError, HTTPError
+import stat
+import time
+import signal
+import subprocess
+from types import MappingProxyType, SimpleNamespace
 
 try:
-    from slack_sdk import WebClient
-    from slack_sdk.errors import SlackApiError
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
-    SLACK_SDK_AVAILABLE = True
+try:
+    import orjson
 except ImportError:
-    SLACK_SDK_AVAILABLE = False
+    orjson = None
+
+# HTTP clients (urllib, urllib3, httpx, slack_sdk) are imported lazily: the
+# hook process itself only spools the event, the background flusher sends it.
+_POOL = None
+_WEBHOOK_TIMEOUT = None
+_URLLIB3_ERRORS = ()
+_HTTP2_CLIENT = None
+MAX_RETRY_AFTER = 3  # seconds; caps Slack's Retry-After so sends stay short
+WEBHOOK_TIMEOUT_SECONDS = 5  # socket timeout for webhook posts
+
+# Success messages are only printed when asked for; errors always go to stderr
+_VERBOSE = bool(os.environ.get("CLAUDE_SLACK_VERBOSE"))
+
+SLACK_POST_MESSAGE_URL = "https://slack.com/api/chat.postMessage"
+
+# Bounded retry loop used by the detached background sender
+DETACHED_SEND_ATTEMPTS = 3
+DETACHED_RETRY_DELAY = 1.0  # seconds, doubled after each failed attempt
+
+# Spool used to batch bursts of events into a single Slack message
+STATE_DIR = os.environ.get("CLAUDE_SLACK_STATE_DIR") or os.path.join(
+    os.path.expanduser("~"), ".claude", "slack_notifier"
+)
+SPOOL_FILE = os.path.join(STATE_DIR, "queue.ndjson")
+FLUSHER_LOCK_FILE = os.path.join(STATE_DIR, "flusher.pid")
+# The detached flusher has no terminal, so its errors are appended here
+LOG_FILE = os.path.join(STATE_DIR, "notifier.log")
+LOG_MAX_BYTES = 1 << 20  # start over once the log grows past 1 MiB
+SPOOL_MAX_BYTES = 1 << 20  # drop new events while this much is still queued
+FLUSHER_MAX_RUNTIME = 300  # seconds before a stuck flusher gives up the lock
+BATCH_WINDOW_MS = 250
+MAX_BATCH_BLOCKS = 50  # Slack's per-message block limit
+
+# Circuit breaker that skips sends for a while after repeated failures
+CIRCUIT_BREAKER_FILE = os.path.join(STATE_DIR, "circuit_breaker.json")
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_BASE_COOLDOWN = 60  # seconds, doubled for each further failure
+CIRCUIT_MAX_COOLDOWN = 3600
+
+# Send results. Only retryable failures (connection errors, timeouts, 429 and
+# 5xx responses) are retried and count towards opening the circuit breaker;
+# configuration errors such as a bad token or a 404 webhook do not.
+SEND_OK = "ok"
+SEND_RETRYABLE = "retryable"
+SEND_FAILED = "failed"
+
+# Header icon, color and title per event type
+_EVENT_CONFIG = MappingProxyType(
+    {
+        "notification": {
+            "emoji": "🔔",
+            "color": "#FFA500",
+            "title": "Claude Code Needs Your Action",
+        },
+        "stop": {
+            "emoji": "✅",
+            "color": "#36a64f",
+            "title": "Claude Code Task Completed",
+        },
+        "user_prompt_submit": {
+            "emoji": "💬",
+            "color": "#2196F3",
+            "title": "Claude Code New Task Started",
+        },
+        "pre_tool_use": {
+            "emoji": "⚠️",
+            "color": "#FF9800",
+            "title": "Claude Code About to Execute Tool",
+        },
+        "post_tool_use": {
+            "emoji": "✔️",
+            "color": "#4CAF50",
+            "title": "Claude Code Tool Execution Completed",
+        },
+    }
+)
+_DEFAULT_CONFIG = MappingProxyType(
+    {"emoji": "ℹ️", "color": "#808080", "title": "Claude Code Event"}
+)
+_MAX_DETAIL = 200  # Detail values longer than this are truncated
+
+# Command line flags handled by parse_args, mapped to their attribute names
+_VALUE_FLAGS = {
+    "--event-type": "event_type",
+    "--mode": "mode",
+    "--webhook-url": "webhook_url",
+    "--token": "token",
+    "--member-id": "member_id",
+    "--message": "message",
+}
+_BOOL_FLAGS = {"--simple": "simple", "--sync": "sync", "--verbose": "verbose"}
+_MODES = ("webhook", "dm")
+
+
+def _dumps(payload):
+    """
+    Serialize payload to compact UTF-8 JSON bytes, using orjson when available
+
+    Lone surrogates (e.g. a prompt cut in the middle of an emoji pair) cannot
+    be encoded as UTF-8; payloads containing them are sent \\uXXXX-escaped.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass
+
+    try:
+        return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode(
+            "utf-8"
+        )
+    except UnicodeEncodeError:
+        return json.dumps(payload, separators=(",", ":")).encode("ascii")
+
+
+def _get_pool():
+    """
+    Create the shared keep-alive pool on first use
+
+    Repeated webhook posts reuse one TLS session. Transient failures are
+    retried in-process with exponential backoff, honoring Slack's Retry-After
+    header on 429 responses for at most MAX_RETRY_AFTER seconds per retry.
+    Returns None if urllib3 is not installed.
+    """
+    global _POOL, _WEBHOOK_TIMEOUT, _URLLIB3_ERRORS
+
+    if _POOL is None:
+        try:
+            import urllib3
+        except ImportError:
+            return None
+
+        class CappedRetry(urllib3.Retry):
+            """Retry that never sleeps longer than MAX_RETRY_AFTER for Retry-After"""
+
+            def get_retry_after(self, response):
+                retry_after = super().get_retry_after(response)
+                if retry_after is None:
+                    return None
+                return min(retry_after, MAX_RETRY_AFTER)
+
+        retry_options = dict(
+            total=4,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods={"POST"},
+            respect_retry_after_header=True,
+        )
+        try:
+            retry = CappedRetry(backoff_jitter=0.2, **retry_options)
+        except TypeError:  # urllib3 < 2.0 has no backoff_jitter
+            retry = CappedRetry(**retry_options)
+
+        _POOL = urllib3.PoolManager(num_pools=2, maxsize=4, retries=retry)
+        _WEBHOOK_TIMEOUT = urllib3.Timeout(connect=2, read=WEBHOOK_TIMEOUT_SECONDS)
+        _URLLIB3_ERRORS = (urllib3.exceptions.HTTPError,)
+
+    return _POOL
+
+
+def _loads(data):
+    """Parse JSON from bytes, using orjson when available"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # json also accepts lone surrogate escapes, which orjson rejects
+    return json.loads(data)
+
+
+def _status_failure(status):
+    """Classify a failed HTTP status: rate limits and server errors are retryable"""
+    return SEND_RETRYABLE if status == 429 or status >= 500 else SEND_FAILED
 
 
 def send_slack_webhook(webhook_url, message, blocks=None):
@@ -29,53 +205,166 @@ def send_slack_webhook(webhook_url, message, blocks=None):
         webhook_url: Slack Webhook URL
         message: Message text
         blocks: Optional Slack block layout
+
+    Returns SEND_OK, SEND_RETRYABLE or SEND_FAILED.
     """
     payload = {"text": message}
 
     if blocks:
         payload["blocks"] = blocks
 
+    from urllib.error import URLError, HTTPError
+
+    body = _dumps(payload)
+    headers = {"Content-Type": "application/json"}
+
     try:
-        request = Request(
-            webhook_url,
-            data=json.dumps(payload).encode("utf-8"),
-            headers={"Content-Type": "application/json"},
-        )
+        pool = _get_pool()
+        if pool is not None:
+            response = pool.request(
+                "POST",
+                webhook_url,
+                body=body,
+                headers=headers,
+                timeout=_WEBHOOK_TIMEOUT,
+            )
+        else:
+            from urllib.request import Request, urlopen
+
+            response = urlopen(
+                Request(webhook_url, data=body, headers=headers),
+                timeout=WEBHOOK_TIMEOUT_SECONDS,
+            )
 
-        response = urlopen(request)
         if response.status == 200:
-            print(f"✓ Slack webhook message sent successfully")
-            return True
+            if _VERBOSE:
+                print("✓ Slack webhook message sent successfully")
+            return SEND_OK
         else:
-            print(f"✗ Failed to send Slack webhook message: {response.status}")
-            return False
+            print(
+                f"✗ Failed to send Slack webhook message: {response.status}",
+                file=sys.stderr,
+            )
+            return _status_failure(response.status)
 
     except HTTPError as e:
-        print(f"✗ HTTP error: {e.code} - {e.reason}")
-        return False
+        print(f"✗ HTTP error: {e.code} - {e.reason}", file=sys.stderr)
+        return _status_failure(e.code)
     except URLError as e:
-        print(f"✗ URL error: {e.reason}")
-        return False
+        print(f"✗ URL error: {e.reason}", file=sys.stderr)
+        return SEND_RETRYABLE
+    except _URLLIB3_ERRORS as e:
+        print(f"✗ Request error: {str(e)}", file=sys.stderr)
+        # Invalid URLs are ValueErrors too; everything else is a transport error
+        return SEND_FAILED if isinstance(e, ValueError) else SEND_RETRYABLE
+    except OSError as e:
+        print(f"✗ Connection error: {str(e)}", file=sys.stderr)
+        return SEND_RETRYABLE
     except Exception as e:
-        print(f"✗ Unknown error: {str(e)}")
-        return False
+        print(f"✗ Unknown error: {str(e)}", file=sys.stderr)
+        return SEND_FAILED
+
+
+def _get_http2_client():
+    """
+    Create the shared HTTP/2 client on first use
+
+    All Slack API calls from the process are multiplexed over one connection.
+    Returns None if httpx or its h2 extra is not installed.
+    """
+    global _HTTP2_CLIENT
+
+    if _HTTP2_CLIENT is None:
+        try:
+            import httpx
+
+            _HTTP2_CLIENT = httpx.Client(http2=True, timeout=5.0)
+        except ImportError:
+            return None
+
+    return _HTTP2_CLIENT
+
+
+def send_slack_dm_http2(client, token, member_id, message, blocks=None):
+    """
+    Send direct message to Slack user by calling chat.postMessage over HTTP/2
+
+    Args:
+        client: Shared httpx client
+        token: Slack Bot Token
+        member_id: Slack Member ID
+        message: Message text
+        blocks: Optional Slack block layout
+
+    Returns SEND_OK, SEND_RETRYABLE or SEND_FAILED.
+    """
+    import httpx
+
+    payload = {"channel": member_id, "text": message}
+
+    if blocks:
+        payload["blocks"] = blocks
+
+    try:
+        response = client.post(
+            SLACK_POST_MESSAGE_URL,
+            content=_dumps(payload),
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json; charset=utf-8",
+            },
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f"✗ HTTP error: {response.status_code}", file=sys.stderr)
+            return SEND_RETRYABLE
+
+        result = response.json()
+
+        if result.get("ok"):
+            if _VERBOSE:
+                print("✓ Slack DM sent successfully")
+            return SEND_OK
+        else:
+            print(
+                f"✗ Slack API error: {result.get('error', response.status_code)}",
+                file=sys.stderr,
+            )
+            return SEND_FAILED
+
+    except httpx.HTTPError as e:
+        print(f"✗ HTTP error: {str(e)}", file=sys.stderr)
+        return SEND_RETRYABLE
+    except Exception as e:
+        print(f"✗ Unknown error: {str(e)}", file=sys.stderr)
+        return SEND_FAILED
 
 
 def send_slack_dm(token, member_id, message, blocks=None):
     """
-    Send direct message to Slack user using Slack SDK
+    Send direct message to Slack user, over HTTP/2 with httpx when available,
+    otherwise using Slack SDK
 
     Args:
         token: Slack Bot Token
         member_id: Slack Member ID
         message: Message text
         blocks: Optional Slack block layout
+
+    Returns SEND_OK, SEND_RETRYABLE or SEND_FAILED.
     """
-    if not SLACK_SDK_AVAILABLE:
+    client = _get_http2_client()
+    if client is not None:
+        return send_slack_dm_http2(client, token, member_id, message, blocks)
+
+    try:
+        from slack_sdk import WebClient
+        from slack_sdk.errors import SlackApiError
+    except ImportError:
         print(
-            "✗ Error: slack_sdk is not installed. Install it with: pip install slack-sdk"
+            "✗ Error: slack_sdk is not installed. Install it with: pip install slack-sdk",
+            file=sys.stderr,
         )
-        return False
+        return SEND_FAILED
 
     try:
         client = WebClient(token=token)
@@ -88,19 +377,448 @@ def send_slack_dm(token, member_id, message, blocks=None):
         response = client.chat_postMessage(**kwargs)
 
         if response["ok"]:
-            print(f"✓ Slack DM sent successfully")
-            return True
+            if _VERBOSE:
+                print("✓ Slack DM sent successfully")
+            return SEND_OK
         else:
-            print(f"✗ Failed to send Slack DM")
-            return False
+            print(f"✗ Failed to send Slack DM", file=sys.stderr)
+            return SEND_FAILED
 
     except SlackApiError as e:
-        print(f"✗ Slack API error: {e.response['error']}")
-        return False
+        print(f"✗ Slack API error: {e.response['error']}", file=sys.stderr)
+        return _status_failure(e.response.status_code)
+    except OSError as e:
+        print(f"✗ Connection error: {str(e)}", file=sys.stderr)
+        return SEND_RETRYABLE
     except Exception as e:
-        print(f"✗ Unknown error: {str(e)}")
+        print(f"✗ Unknown error: {str(e)}", file=sys.stderr)
+        return SEND_FAILED
+
+
+def _open_state_file(path):
+    """Open (creating if needed) a private file in the notifier state directory"""
+    os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+    return os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+
+
+def _destination_key(delivery):
+    """
+    Identify a notification's destination for the circuit breaker
+
+    Webhooks are keyed by URL and DMs by bot token, hashed so no credentials
+    end up in the state file.
+
+    Args:
+        delivery: Dict with mode, credentials, message and optional blocks
+    """
+    import hashlib
+
+    secret = delivery.get("webhook_url") or delivery.get("token") or ""
+    digest = hashlib.sha256(f"{delivery['mode']}\0{secret}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _update_circuit(key, update):
+    """
+    Apply update(state) to one destination's breaker state under an exclusive lock
+
+    Args:
+        key: Destination key from _destination_key
+        update: Callable that may modify the state dict in place
+
+    Returns the result of update, or None if the state file is unavailable.
+    """
+    if fcntl is None:
+        return None
+
+    try:
+        fd = _open_state_file(CIRCUIT_BREAKER_FILE)
+    except OSError:
+        return None
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        try:
+            states = json.loads(b"".join(chunks) or b"{}")
+        except ValueError:
+            states = {}
+        if not isinstance(states, dict):
+            states = {}
+        # Drop anything that isn't a per-destination entry (e.g. old file format)
+        states = {k: v for k, v in states.items() if isinstance(v, dict)}
+
+        before = dict(states.get(key, {}))
+        state = dict(before)
+        result = update(state)
+        if state != before:
+            if state:
+                states[key] = state
+            else:
+                states.pop(key, None)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps(states).encode("utf-8"))
+        return result
+    finally:
+        os.close(fd)
+
+
+def circuit_is_open(key):
+    """
+    Check whether sends to a destination are short-circuited after repeated failures
+
+    Args:
+        key: Destination key from _destination_key
+    """
+
+    def check(state):
+        open_until_ts = state.get("open_until_ts", 0)
+        if time.time() >= open_until_ts:
+            return False
+        if not state.get("logged"):
+            resume_at = time.strftime("%H:%M:%S", time.localtime(open_until_ts))
+            print(
+                f"✗ Slack unreachable, skipping notifications until {resume_at}",
+                file=sys.stderr,
+            )
+            state["logged"] = True
+        return True
+
+    return bool(_update_circuit(key, check))
+
+
+def record_send_result(key, status):
+    """
+    Update a destination's circuit breaker after a send
+
+    Success resets it and retryable failures count towards opening it.
+    Configuration errors leave it untouched, so one misconfigured
+    destination never silences the others or trips its own breaker.
+
+    Args:
+        key: Destination key from _destination_key
+        status: SEND_OK, SEND_RETRYABLE or SEND_FAILED
+    """
+
+    def record(state):
+        if status == SEND_OK:
+            state.clear()
+            return
+        if status != SEND_RETRYABLE:
+            return
+
+        fail_count = state.get("fail_count", 0) + 1
+        state["fail_count"] = fail_count
+        if fail_count >= CIRCUIT_FAILURE_THRESHOLD:
+            import random
+
+            cooldown = min(
+                CIRCUIT_BASE_COOLDOWN * 2 ** (fail_count - CIRCUIT_FAILURE_THRESHOLD),
+                CIRCUIT_MAX_COOLDOWN,
+            )
+            state["open_until_ts"] = time.time() + cooldown * random.uniform(1, 1.25)
+            state["logged"] = False
+
+    _update_circuit(key, record)
+
+
+def _send(delivery):
+    """
+    Send a prepared notification once using the mode it was built for
+
+    Args:
+        delivery: Dict with mode, credentials, message and optional blocks
+
+    Returns SEND_OK, SEND_RETRYABLE or SEND_FAILED.
+    """
+    if delivery["mode"] == "webhook":
+        return send_slack_webhook(
+            delivery["webhook_url"], delivery["message"], delivery.get("blocks")
+        )
+    return send_slack_dm(
+        delivery["token"],
+        delivery["member_id"],
+        delivery["message"],
+        delivery.get("blocks"),
+    )
+
+
+def deliver(delivery, attempts=1):
+    """
+    Send a prepared notification, retrying retryable failures with backoff
+
+    The destination's circuit breaker is checked before every attempt but
+    updated only once per notification, so retries don't count as separate
+    failures.
+
+    Args:
+        delivery: Dict with mode, credentials, message and optional blocks
+        attempts: Maximum number of send attempts
+    """
+    key = _destination_key(delivery)
+    if circuit_is_open(key):
         return False
 
+    status = _send(delivery)
+    for attempt in range(1, attempts):
+        if status != SEND_RETRYABLE or circuit_is_open(key):
+            break
+        time.sleep(DETACHED_RETRY_DELAY * 2 ** (attempt - 1))
+        status = _send(delivery)
+
+    record_send_result(key, status)
+    return status == SEND_OK
+
+
+def enqueue(delivery):
+    """
+    Append a notification to the spool file
+
+    Args:
+        delivery: Dict with mode, credentials, message and optional blocks
+
+    Returns False, without writing, if the spool is already full.
+    """
+    line = _dumps(delivery) + b"\n"
+    fd = _open_state_file(SPOOL_FILE)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.lseek(fd, 0, os.SEEK_END) + len(line) > SPOOL_MAX_BYTES:
+            return False
+        os.write(fd, line)
+        return True
+    finally:
+        os.close(fd)
+
+
+def take_spooled(flusher_fd):
+    """
+    Read and clear all spooled notifications
+
+    When the spool is empty the flusher lock is released while the spool
+    lock is still held, so an event appended right afterwards always finds
+    no running flusher and starts a new one.
+
+    Args:
+        flusher_fd: File descriptor holding the flusher lock
+    """
+    fd = _open_state_file(SPOOL_FILE)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.ftruncate(fd, 0)
+
+        deliveries = []
+        for line in b"".join(chunks).splitlines():
+            try:
+                deliveries.append(_loads(line))
+            except ValueError:
+                continue
+
+        if not deliveries:
+            fcntl.flock(flusher_fd, fcntl.LOCK_UN)
+        return deliveries
+    finally:
+        os.close(fd)
+
+
+def build_batches(deliveries):
+    """
+    Coalesce spooled notifications into as few Slack messages as possible
+
+    Notifications are grouped by destination. Rich messages are merged until
+    Slack's per-message block limit is reached, plain text messages are
+    joined line by line.
+
+    Args:
+        deliveries: Spooled notifications in arrival order
+    """
+    batches = []
+    open_batches = {}
+
+    for delivery in deliveries:
+        blocks = delivery.get("blocks") or []
+        key = (
+            delivery["mode"],
+            delivery.get("webhook_url"),
+            delivery.get("token"),
+            delivery.get("member_id"),
+            bool(blocks),
+        )
+
+        batch = open_batches.get(key)
+        if batch is None or len(blocks) + len(batch["blocks"] or []) > MAX_BATCH_BLOCKS:
+            batch = dict(delivery, blocks=list(blocks) or None)
+            open_batches[key] = batch
+            batches.append(batch)
+        else:
+            batch["message"] += "\n" + delivery["message"]
+            if blocks:
+                batch["blocks"].extend(blocks)
+
+    return batches
+
+
+def _open_log_file():
+    """Open the flusher log for appending, starting over once it gets too large"""
+    os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+    flags = os.O_CREAT | os.O_WRONLY | os.O_APPEND
+    try:
+        if os.path.getsize(LOG_FILE) > LOG_MAX_BYTES:
+            flags |= os.O_TRUNC
+    except OSError:
+        pass
+    return os.open(LOG_FILE, flags, 0o600)
+
+
+def flusher_running():
+    """Check whether a background flusher currently holds the lock"""
+    fd = _open_state_file(FLUSHER_LOCK_FILE)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def dispatch_detached(delivery):
+    """
+    Spool the notification and make sure a detached flusher will send it,
+    so Slack latency never blocks Claude Code
+
+    Args:
+        delivery: Dict with mode, credentials, message and optional blocks
+    """
+    if fcntl is None:
+        # No flock on this platform, fall back to sending inline
+        deliver(delivery)
+        return
+
+    try:
+        spooled = enqueue(delivery)
+    except OSError as e:
+        print(
+            f"Warning: Unable to spool notification ({e}), sending inline",
+            file=sys.stderr,
+        )
+        deliver(delivery)
+        return
+
+    if not spooled:
+        # The flusher is stuck or Slack is down; don't let the spool grow unbounded
+        print(
+            f"Warning: Notification spool is full, dropping event (see {LOG_FILE})",
+            file=sys.stderr,
+        )
+
+    if flusher_running():
+        return
+
+    try:
+        log_fd = _open_log_file()
+        try:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--send-detached"],
+                stdin=subprocess.DEVNULL,
+                stdout=log_fd,
+                stderr=log_fd,
+                start_new_session=True,
+            )
+        finally:
+            os.close(log_fd)
+    except OSError as e:
+        print(
+            f"Warning: Unable to start background sender ({e}), sending inline",
+            file=sys.stderr,
+        )
+        run_flusher()
+
+
+def send_with_retry(delivery):
+    """Send a notification with a bounded retry loop"""
+    # Webhook posts through the urllib3 pool already retry in-process
+    if delivery["mode"] == "webhook" and _get_pool() is not None:
+        return deliver(delivery)
+    return deliver(delivery, attempts=DETACHED_SEND_ATTEMPTS)
+
+
+class FlusherTimeout(BaseException):
+    """
+    Raised by SIGALRM when the flusher exceeds FLUSHER_MAX_RUNTIME
+
+    Derives from BaseException so the senders' broad except clauses can't
+    swallow it.
+    """
+
+
+def _flusher_timed_out(signum, frame):
+    raise FlusherTimeout()
+
+
+def run_flusher():
+    """
+    Drain the spool in batches until it is empty
+
+    Only one flusher runs at a time; if another one holds the lock it will
+    pick up our spooled events, so we exit immediately. A hard time limit
+    makes sure a send that never returns can't hold the lock forever; events
+    left in the spool are picked up by the flusher the next hook starts.
+    """
+    lock_fd = _open_state_file(FLUSHER_LOCK_FILE)
+    previous_handler = None
+    try:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        os.ftruncate(lock_fd, 0)
+        os.write(lock_fd, str(os.getpid()).encode("ascii"))
+
+        previous_handler = signal.signal(signal.SIGALRM, _flusher_timed_out)
+        signal.alarm(FLUSHER_MAX_RUNTIME)
+
+        while True:
+            # Give bursts of hook events time to accumulate
+            time.sleep(BATCH_WINDOW_MS / 1000)
+            deliveries = take_spooled(lock_fd)
+            if not deliveries:
+                return
+            for batch in build_batches(deliveries):
+                if not send_with_retry(batch):
+                    failed_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                    print(
+                        f"✗ [{failed_at}] Dropped {batch['mode']} notification "
+                        "after failed delivery",
+                        file=sys.stderr,
+                        flush=True,
+                    )
+    except FlusherTimeout:
+        failed_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        print(
+            f"✗ [{failed_at}] Flusher exceeded {FLUSHER_MAX_RUNTIME}s, "
+            "giving up; queued events will be sent by the next flusher",
+            file=sys.stderr,
+            flush=True,
+        )
+    finally:
+        if previous_handler is not None:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
+        os.close(lock_fd)
+
 
 def create_notification_blocks(event_type, details):
     """
@@ -110,154 +828,134 @@ def create_notification_blocks(event_type, details):
         event_type: Event type
         details: Event details
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
     # Choose icon and color based on event type
-    event_config = {
-        "notification": {
-            "emoji": "🔔",
-            "color": "#FFA500",
-            "title": "Claude Code Needs Your Action",
-        },
-        "stop": {
-            "emoji": "✅",
-            "color": "#36a64f",
-            "title": "Claude Code Task Completed",
-        },
-        "user_prompt_submit": {
-            "emoji": "💬",
-            "color": "#2196F3",
-            "title": "Claude Code New Task Started",
-        },
-        "pre_tool_use": {
-            "emoji": "⚠️",
-            "color": "#FF9800",
-            "title": "Claude Code About to Execute Tool",
-        },
-        "post_tool_use": {
-            "emoji": "✔️",
-            "color": "#4CAF50",
-            "title": "Claude Code Tool Execution Completed",
-        },
-    }
-
-    config = event_config.get(
-        event_type, {"emoji": "ℹ️", "color": "#808080", "title": "Claude Code Event"}
-    )
+    config = _EVENT_CONFIG.get(event_type, _DEFAULT_CONFIG)
 
-    blocks = [
-        {
-            "type": "header",
-            "text": {
-                "type": "plain_text",
-                "text": f"{config['emoji']} {config['title']}",
-                "emoji": True,
-            },
+    header_block = {
+        "type": "header",
+        "text": {
+            "type": "plain_text",
+            "text": f"{config['emoji']} {config['title']}",
+            "emoji": True,
         },
-        {
-            "type": "section",
-            "fields": [
-                {"type": "mrkdwn", "text": f"*Time:*\n{timestamp}"},
-                {"type": "mrkdwn", "text": f"*Event Type:*\n`{event_type}`"},
-            ],
-        },
-    ]
+    }
+    summary_block = {
+        "type": "section",
+        "fields": [
+            {"type": "mrkdwn", "text": f"*Time:*\n{timestamp}"},
+            {"type": "mrkdwn", "text": f"*Event Type:*\n`{event_type}`"},
+        ],
+    }
 
     path = details.get("CWD")
 
-    # Add project information (if available)
-    if path:
-        blocks.append(
-            {
-                "type": "section",
-                "fields": [{"type": "mrkdwn", "text": f"*Path:*\n`{path}`"}],
-            }
-        )
-
-    # Add detailed information
-    if details:
-        detail_text = ""
-        for key, value in details.items():
-            if key == "CWD":
-                continue
-            if value:
-                # Truncate long values
-                if isinstance(value, str) and len(value) > 200:
-                    value = value[:200] + "..."
-                detail_text += f"*{key}:*\n```{value}```\n"
-
-        if detail_text:
-            blocks.append(
-                {"type": "section", "text": {"type": "mrkdwn", "text": detail_text}}
-            )
-
-    # Add IDE jump buttons (if project path is available)
+    # Project information and IDE jump buttons (if project path is available)
     if path:
         goland_url = f"goland://open?file={path}"
         cursor_url = f"cursor://file/{path}"
-        blocks.append(
-            {
-                "type": "actions",
-                "elements": [
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🚀 Open in GoLand",
-                            "emoji": True,
-                        },
-                        "url": goland_url,
-                        "style": "primary",
+        path_block = {
+            "type": "section",
+            "fields": [{"type": "mrkdwn", "text": f"*Path:*\n`{path}`"}],
+        }
+        actions_block = {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "🚀 Open in GoLand",
+                        "emoji": True,
                     },
-                    {
-                        "type": "button",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "✨ Open in Cursor",
-                            "emoji": True,
-                        },
-                        "url": cursor_url,
+                    "url": goland_url,
+                    "style": "primary",
+                },
+                {
+                    "type": "button",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "✨ Open in Cursor",
+                        "emoji": True,
                     },
-                ],
-            }
-        )
+                    "url": cursor_url,
+                },
+            ],
+        }
 
-    blocks.append({"type": "divider"})
+    # Detailed information
+    parts = []
+    for key, value in details.items():
+        if key == "CWD":
+            continue
+        if value:
+            # Truncate long values
+            if isinstance(value, str) and len(value) > _MAX_DETAIL:
+                value = value[:_MAX_DETAIL] + "..."
+            parts.append(f"*{key}:*\n```{value}```\n")
+    detail_text = "".join(parts)
 
-    return blocks
+    # Build the final list in one go instead of growing it block by block
+    return [
+        header_block,
+        summary_block,
+        *((path_block,) if path else ()),
+        *(
+            ({"type": "section", "text": {"type": "mrkdwn", "text": detail_text}},)
+            if detail_text
+            else ()
+        ),
+        *((actions_block,) if path else ()),
+        {"type": "divider"},
+    ]
+
+
+def _short(value, limit=_MAX_DETAIL):
+    """
+    Stringify a detail value, keeping just enough for the truncated display
+
+    Args:
+        value: Detail value, possibly a large dict or list
+        limit: Display limit; one extra character is kept so the caller
+            can still tell the value was truncated
+    """
+    if isinstance(value, (dict, list)):
+        text = json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    return text[: limit + 1]
 
 
 def parse_stdin_json():
     """Read JSON data from stdin"""
     try:
-        if not sys.stdin.isatty():
-            data = sys.stdin.read()
+        # Skip terminals (and other character devices) instead of blocking on them
+        if not stat.S_ISCHR(os.fstat(sys.stdin.fileno()).st_mode):
+            data = sys.stdin.buffer.read()
             if data.strip():
-                return json.loads(data)
+                return _loads(data)
     except json.JSONDecodeError as e:
-        print(f"Warning: Unable to parse JSON input: {e}")
+        print(f"Warning: Unable to parse JSON input: {e}", file=sys.stderr)
     except Exception as e:
-        print(f"Warning: Error reading stdin: {e}")
+        print(f"Warning: Error reading stdin: {e}", file=sys.stderr)
     return None
 
 
-def main():
+def build_parser():
+    """Build the full argparse parser, used for --help and error reporting"""
+    import argparse
+
     parser = argparse.ArgumentParser(description="Claude Code Slack Notification Tool")
     parser.add_argument(
         "--event-type",
         required=True,
-        choices=[
-            "notification",
-            "stop",
-            "user_prompt_submit",
-            "pre_tool_use",
-            "post_tool_use",
-        ],
+        choices=list(_EVENT_CONFIG),
         help="Event type",
     )
     parser.add_argument(
         "--mode",
-        choices=["webhook", "dm"],
+        choices=list(_MODES),
         default="dm",
         help="Notification mode: webhook or dm (default: dm)",
     )
@@ -279,8 +977,70 @@ def main():
         action="store_true",
         help="Use simple text message instead of rich text blocks",
     )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Send in the foreground and wait for the result (useful for testing)",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print a message on successful delivery "
+        "(or set CLAUDE_SLACK_VERBOSE environment variable)",
+    )
+
+    return parser
+
+
+def parse_args(argv):
+    """
+    Parse command line flags without constructing an argparse parser
+
+    The hook's flag set is small and fixed, so a plain scan is enough on the
+    hot path. Anything unexpected (--help, unknown flags, invalid choices,
+    missing values) is handed to argparse for its usual usage and errors.
+
+    Args:
+        argv: Command line arguments without the program name
+    """
+    args = dict.fromkeys(_VALUE_FLAGS.values())
+    args.update(dict.fromkeys(_BOOL_FLAGS.values(), False))
+    args["mode"] = "dm"
 
-    args = parser.parse_args()
+    i = 0
+    while i < len(argv):
+        name, sep, value = argv[i].partition("=")
+        if name in _VALUE_FLAGS:
+            if not sep:
+                i += 1
+                # Like argparse, don't take another flag as the value
+                if i >= len(argv) or argv[i].startswith("--"):
+                    return build_parser().parse_args(argv)
+                value = argv[i]
+            args[_VALUE_FLAGS[name]] = value
+        elif argv[i] in _BOOL_FLAGS:
+            args[_BOOL_FLAGS[argv[i]]] = True
+        else:
+            return build_parser().parse_args(argv)
+        i += 1
+
+    if args["event_type"] not in _EVENT_CONFIG or args["mode"] not in _MODES:
+        return build_parser().parse_args(argv)
+
+    return SimpleNamespace(**args)
+
+
+def main():
+    # Internal entry point used by dispatch_detached
+    if sys.argv[1:] == ["--send-detached"]:
+        run_flusher()
+        return
+
+    global _VERBOSE
+
+    args = parse_args(sys.argv[1:])
+    if args.verbose:
+        _VERBOSE = True
 
     # Read event data from stdin
     event_data = parse_stdin_json()
@@ -296,9 +1056,9 @@ def main():
         if "tool_name" in event_data:
             details["Tool Name"] = event_data["tool_name"]
         if "tool_input" in event_data:
-            details["Tool Input"] = str(event_data["tool_input"])
+            details["Tool Input"] = _short(event_data["tool_input"])
         if "tool_result" in event_data:
-            details["Tool Result"] = str(event_data["tool_result"])
+            details["Tool Result"] = _short(event_data["tool_result"])
         if "prompt" in event_data:
             details["Prompt"] = event_data["prompt"]
         if "session_id" in event_data:
@@ -316,26 +1076,37 @@ def main():
         webhook_url = args.webhook_url or os.environ.get("SLACK_WEBHOOK_URL")
         if not webhook_url:
             print(
-                "Error: Must provide --webhook-url or set SLACK_WEBHOOK_URL environment variable"
+                "Error: Must provide --webhook-url or set SLACK_WEBHOOK_URL environment variable",
+                file=sys.stderr,
             )
             sys.exit(1)
-        send_slack_webhook(webhook_url, message, blocks)
+        delivery = {"mode": "webhook", "webhook_url": webhook_url}
     else:  # dm mode
         token = args.token or os.environ.get("SLACK_CLAUDE_CODE_BOT_TOKEN")
         member_id = args.member_id or os.environ.get("SLACK_MEMBER_ID")
 
         if not token:
             print(
-                "Error: Must provide --token or set SLACK_CLAUDE_CODE_BOT_TOKEN environment variable"
+                "Error: Must provide --token or set SLACK_CLAUDE_CODE_BOT_TOKEN environment variable",
+                file=sys.stderr,
             )
             sys.exit(1)
         if not member_id:
             print(
-                "Error: Must provide --member-id or set SLACK_MEMBER_ID environment variable"
+                "Error: Must provide --member-id or set SLACK_MEMBER_ID environment variable",
+                file=sys.stderr,
             )
             sys.exit(1)
 
-        send_slack_dm(token, member_id, message, blocks)
+        delivery = {"mode": "dm", "token": token, "member_id": member_id}
+
+    delivery["message"] = message
+    delivery["blocks"] = blocks
+
+    if args.sync:
+        deliver(delivery)
+    else:
+        dispatch_detached(delivery)
 
 
 if __name__ == "__main__":
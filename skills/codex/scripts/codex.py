@@ -15,8 +15,11 @@ Usage:
 """
 import subprocess
 import json
+import shutil
 import sys
 import os
+import threading
+from functools import lru_cache
 from typing import Optional
 
 DEFAULT_MODEL = 'gpt-5.1-codex'
@@ -24,6 +27,10 @@ DEFAULT_WORKDIR = '.'
 DEFAULT_TIMEOUT = 7200  # 2 hours in seconds
 FORCE_KILL_DELAY = 5
 STDIN_THRESHOLD = 800  # Auto-switch to stdin for prompts longer than 800 chars
+STDOUT_BUFSIZE = 1 << 20  # 1 MiB read buffer for the JSON event stream
+CODEX_BIN_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'claude_codex_bin')
+# Only lines containing one of these markers are worth a full JSON parse
+EVENT_MARKERS = (b'"thread.started"', b'"agent_message"', b'"turn.completed"')
 
 
 def log_error(message: str):
@@ -36,8 +43,9 @@ def log_warn(message: str):
     sys.stderr.write(f"WARN: {message}\n")
 
 
+@lru_cache(maxsize=1)
 def resolve_timeout() -> int:
-    """解析超时配置（秒）"""
+    """解析超时配置（秒），结果缓存，CODEX_TIMEOUT 只解析一次"""
     raw = os.environ.get('CODEX_TIMEOUT', '')
     if not raw:
         return DEFAULT_TIMEOUT
@@ -54,6 +62,40 @@ def resolve_timeout() -> int:
         return DEFAULT_TIMEOUT
 
 
+@lru_cache(maxsize=1)
+def resolve_codex_bin() -> str:
+    """
+    解析 codex 可执行文件的绝对路径
+
+    结果连同当时的 PATH 持久化到 CODEX_BIN_CACHE。PATH 未变且缓存文件仍是可执行
+    文件时直接复用，无需再搜索 PATH；PATH 变化（如切换 node/nvm 版本）则重新解析。
+    找不到时返回 'codex'，由 Popen 报告 FileNotFoundError。
+    """
+    search_path = os.environ.get('PATH', '')
+
+    try:
+        with open(CODEX_BIN_CACHE, encoding='utf-8') as f:
+            cache = json.load(f)
+        cached = cache.get('bin')
+        if (cache.get('path') == search_path and isinstance(cached, str)
+                and os.path.isfile(cached) and os.access(cached, os.X_OK)):
+            return cached
+    except (OSError, ValueError, AttributeError):
+        pass  # 缓存缺失或损坏，重新解析
+
+    resolved = shutil.which('codex')
+    if not resolved:
+        return 'codex'
+
+    try:
+        os.makedirs(os.path.dirname(CODEX_BIN_CACHE), exist_ok=True)
+        with open(CODEX_BIN_CACHE, 'w', encoding='utf-8') as f:
+            json.dump({'path': search_path, 'bin': resolved}, f)
+    except OSError:
+        pass  # 缓存失败不影响执行
+    return resolved
+
+
 def normalize_text(text) -> Optional[str]:
     """规范化文本：字符串或字符串数组"""
     if isinstance(text, str):
@@ -63,6 +105,27 @@ def normalize_text(text) -> Optional[str]:
     return None
 
 
+def write_stdin(pipe, data: bytes):
+    """
+    将任务写入 codex stdin 并关闭管道
+
+    在后台线程中运行，主线程同时消费 stdout，避免大任务时双方管道写满互相阻塞。
+    """
+    fd = pipe.fileno()
+    view = memoryview(data)
+    try:
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    except BrokenPipeError:
+        pass  # codex 提前退出，错误由返回码报告
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
 def parse_args():
     """解析命令行参数"""
     if len(sys.argv) < 2:
@@ -98,10 +161,12 @@ def build_codex_args(params: dict, use_stdin: bool) -> list:
         params: 参数字典
         use_stdin: 是否使用 stdin 模式（不在命令行参数中传递 task）
     """
+    codex_bin = resolve_codex_bin()
+
     if params['mode'] == 'resume':
         if use_stdin:
             return [
-                'codex', 'e',
+                codex_bin, 'e',
                 '--skip-git-repo-check',
                 '--json',
                 'resume',
@@ -110,7 +175,7 @@ def build_codex_args(params: dict, use_stdin: bool) -> list:
             ]
         else:
             return [
-                'codex', 'e',
+                codex_bin, 'e',
                 '--skip-git-repo-check',
                 '--json',
                 'resume',
@@ -119,7 +184,7 @@ def build_codex_args(params: dict, use_stdin: bool) -> list:
             ]
     else:
         base_args = [
-            'codex', 'e',
+            codex_bin, 'e',
             '-m', params['model'],
             '--dangerously-bypass-approvals-and-sandbox',
             '--skip-git-repo-check',
@@ -150,29 +215,43 @@ def main():
 
     thread_id: Optional[str] = None
     last_agent_message: Optional[str] = None
+    turn_completed = False
 
     try:
         # 启动 codex 子进程
+        # 绝对路径（resolve_codex_bin）省去子进程内的 PATH 查找；CPython 3.10+ 在 Linux 上
+        # 本身即用 vfork 启动子进程，无需 close_fds=False。保留 close_fds=True，避免调用方
+        # 传入的可继承 fd 泄漏给 codex
         process = subprocess.Popen(
             codex_args,
             stdin=subprocess.PIPE if use_stdin else None,  # **FIX: Enable stdin**
             stdout=subprocess.PIPE,
-            stderr=sys.stderr,  # 错误直接透传到 stderr
-            text=True,
-            bufsize=1  # 行缓冲
+            stderr=None,  # 继承 stderr，错误直接透传
+            bufsize=STDOUT_BUFSIZE,  # 二进制模式 + 大缓冲区，避免逐行解码
+            close_fds=True
         )
 
         # **FIX: 如果使用 stdin 模式，写入任务到 stdin**
+        # 后台线程写入，避免 stdout 管道写满时死锁
+        writer = None
         if use_stdin:
-            process.stdin.write(params['task'])
-            process.stdin.close()
-
-        # 逐行解析 JSON 输出
-        for line in process.stdout:
-            line = line.strip()
+            writer = threading.Thread(
+                target=write_stdin,
+                args=(process.stdin, params['task'].encode('utf-8')),
+                daemon=True
+            )
+            writer.start()
+
+        # 逐行解析 JSON 输出（json.loads 直接接受 bytes）
+        for raw in iter(process.stdout.readline, b''):
+            line = raw.strip()
             if not line:
                 continue
 
+            # 快速字节过滤：跳过无关事件，避免完整 JSON 解析
+            if not any(marker in line for marker in EVENT_MARKERS):
+                continue
+
             try:
                 event = json.loads(line)
 
@@ -187,8 +266,22 @@ def main():
                     if text:
                         last_agent_message = text
 
-            except json.JSONDecodeError:
-                log_warn(f"Failed to parse line: {line}")
+                # turn.completed 是最后一个有用事件，之后的输出无需再解析
+                if event.get('type') == 'turn.completed':
+                    turn_completed = True
+                    break
+
+            except ValueError:  # JSONDecodeError 或非法 UTF-8
+                log_warn(f"Failed to parse line: {line.decode('utf-8', errors='replace')}")
+
+        if turn_completed:
+            # 剩余输出只按块读掉不再解析；不提前关闭管道，以免 codex 写入失败
+            # (BrokenPipeError) 并丢失其真实退出码
+            while process.stdout.read(STDOUT_BUFSIZE):
+                pass
+
+        if writer is not None:
+            writer.join()
 
         # 等待进程结束
         returncode = process.wait(timeout=timeout_sec)
@@ -223,6 +316,10 @@ def main():
         log_error("codex command not found in PATH")
         sys.exit(127)
 
+    except PermissionError:
+        log_error(f"codex command is not executable: {codex_args[0]}")
+        sys.exit(126)
+
     except KeyboardInterrupt:
         process.terminate()
         try: